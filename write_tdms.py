@@ -9,17 +9,24 @@ of 200k samples per second (the maximum sample rate of the myDAQ).
 
 
 import os
-from datetime import datetime
+import re
+import threading
+import time
 import tkinter as tk
 from tkinter import ttk
 import ctypes
+from ctypes import wintypes
 
 import numpy as np
 import matplotlib.backends.backend_tkagg as tkagg
 from matplotlib.figure import Figure
 import nidaqmx
 import nidaqmx.constants as nico
-from nidaqmx.stream_readers import AnalogSingleChannelReader
+from nidaqmx._lib import lib_importer
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
 
 
 __author__ = "Jaimy Plugge"
@@ -28,20 +35,102 @@ __author__ = "Jaimy Plugge"
 FONT=(35)
 TEXTVARIABLE_FONT = (20)
 
+# Number of blocks the DAQ callback can run ahead of the plot
+RING_SLOTS = 8
+# Interval in ms at which the GUI plots the newest block
+DRAIN_INTERVAL = 33
+# Interval in ms at which the sample counter is updated
+COUNTER_INTERVAL = 200
+# Interval in ms at which the logged samples are counted in log only mode
+LOG_POLL_INTERVAL = 500
+# Number of min/max pairs plotted per block, about the width of the plot
+PLOT_POINTS = 2000
+
+# Number with an optional k or M suffix, e.g. "200k" or "1.5 M"
+NUMBER_RE = re.compile(r"([0-9]*\.?[0-9]+(?:[eE][0-9]+)?)\s*([kM]?)")
+SI_PREFIXES = {"": 1, "k": 1e3, "M": 1e6}
+PAGE_SIZE = 4096
+TDMS_NAME_FORMAT = "/TDMS_%Y%m%d-%H%M%S.tdms"
+# Windows priority of the DAQmx callback thread
+THREAD_PRIORITY_ABOVE_NORMAL = 1
+# Calling convention of the functions in lib_importer.windll
+FUNCTYPE = getattr(ctypes, "WINFUNCTYPE", ctypes.CFUNCTYPE)
+
+
+def new_tdms_name(folder):
+    """Path of a new TDMS file in folder, named after the local time."""
+    return folder + time.strftime(TDMS_NAME_FORMAT)
+
+
+def aligned_empty(shape, dtype, alignment=PAGE_SIZE):
+    """
+    Return an uninitialised array in which every row along the last axis is
+    contiguous and starts on an alignment byte boundary. The rows are padded
+    to a multiple of alignment, the padding is not part of the array.
+    """
+    dtype = np.dtype(dtype)
+    row_items = -(-shape[-1] * dtype.itemsize // alignment) * alignment \
+                // dtype.itemsize
+    padded = np.empty(int(np.prod(shape[:-1])) * row_items * dtype.itemsize 
+                      + alignment, np.uint8)
+    offset = -padded.ctypes.data % alignment
+    rows = padded[offset:offset + len(padded) - alignment].view(dtype)
+    return rows.reshape(tuple(shape[:-1]) + (row_items,))[..., :shape[-1]]
+
+
+def decimate(data, stride, coeffs, out):
+    """
+    Reduce raw samples to the minimum and maximum of every stride samples,
+    write them interleaved into out, which holds two values per stride, and
+    scale them to volts with the polynomial coefficients of the channel.
+    This draws the same envelope as plotting every sample.
+    """
+    n = len(out) // 2
+    blocks = data[:n*stride].reshape(n, stride)
+    np.min(blocks, axis=1, out=out[0::2])
+    np.max(blocks, axis=1, out=out[1::2])
+    out[:] = np.polynomial.polynomial.polyval(out, coeffs)
+
+
+if njit is not None:
+    @njit(cache=True, parallel=True, fastmath=True)
+    def decimate(data, stride, coeffs, out):
+        """
+        Same as the NumPy version above, fused into a single pass over the
+        samples: min, max and scaling of each stride are done in registers.
+        """
+        for i in prange(len(out) // 2):
+            lo = hi = data[i*stride]
+            for j in range(i*stride + 1, (i + 1)*stride):
+                value = data[j]
+                if value < lo:
+                    lo = value
+                elif value > hi:
+                    hi = value
+            y_lo = y_hi = coeffs[-1]
+            for k in range(len(coeffs) - 2, -1, -1):
+                y_lo = y_lo*lo + coeffs[k]
+                y_hi = y_hi*hi + coeffs[k]
+            out[2*i] = y_lo
+            out[2*i + 1] = y_hi
+
 
 class Reader: 
+    __slots__ = ("physical_channels", "number_of_channels", "sample_rate", 
+                 "block_size", "logging", "min", "max", "termconfig", 
+                 "callback", "task", "w_idx", "r_idx", "scaling", "ring", 
+                 "data_in", "read_raw", "task_handle", "fill_mode", 
+                 "slot_pointers", "slot_size", "samps_read", "samps_read_ref")
+
     def __init__(self, physical_channels, sample_rate, block_size, logging, 
                  volt_range, termconfig, callback):
-        self.settings = { "physical channels"  : physical_channels,
-                          "number of channels" : len(
-                            nidaqmx._task_modules.channels.channel.Channel(
-                            0,physical_channels).channel_names
-                            ),
-                          "sample rate"        : sample_rate,
-                          "sample block size"  : block_size
-                        }
-
+        # The block size sets how often the DAQ callback fires, keep that at
+        # a UI rate of at most 10 Hz. TDMS logging is done by the driver and
+        # does not depend on it.
+        block_size = max(block_size, sample_rate // 10)
         self.physical_channels = physical_channels
+        self.number_of_channels = (physical_channels.count(",") + 1 
+                                   if physical_channels else 0)
         self.sample_rate = sample_rate
         self.block_size = block_size
         self.logging = logging
@@ -49,12 +138,14 @@ class Reader:
         self.termconfig = termconfig
         self.callback = callback
 
-        self.data_in = np.zeros((self.settings["sample block size"]),'d')
+        self.task = False
+        self.w_idx = 0
+        self.r_idx = 0
 
     def configure_task(self):
         self.task = nidaqmx.Task()
         self.task.ai_channels.add_ai_voltage_chan(
-            self.settings["physical channels"],
+            self.physical_channels,
             terminal_config=self.termconfig,
             min_val=self.min, max_val=self.max)
         self.task.in_stream.auto_start=0
@@ -63,12 +154,83 @@ class Reader:
             rate=self.sample_rate, source="OnboardClock", 
             sample_mode= nico.AcquisitionType.CONTINUOUS,
             samps_per_chan=10*self.sample_rate)
-
-        self.channel_reader = AnalogSingleChannelReader(self.task.in_stream)
+        # Room for at least ten seconds or ten blocks, whether logging or not,
+        # so a stall in Python does not overflow the buffer
+        self.task.in_stream.input_buf_size = max(10*self.sample_rate, 
+                                                 10*self.block_size)
+
+        # Without a callback the driver only logs, nothing below is needed
+        if self.callback is None:
+            return
+
+        # Read the raw ADC counts, only the plotted points are scaled to volts
+        channels = [self.task.ai_channels[i] 
+                    for i in range(self.number_of_channels)]
+        self.scaling = [np.array(channel.ai_dev_scaling_coeff) 
+                        for channel in channels]
+        if channels[0].ai_raw_samp_size <= 16:
+            dtype, read_func = np.int16, lib_importer.windll.DAQmxReadBinaryI16
+        else:
+            dtype, read_func = np.int32, lib_importer.windll.DAQmxReadBinaryI32
+
+        # Single producer, single consumer: the DAQ callback writes block 
+        # w_idx into the ring and is the only writer of w_idx, the GUI only
+        # writes r_idx and reads w_idx once per pass. Rebinding an int is 
+        # atomic under the GIL, so no lock or queue is needed between them.
+        nchan = self.number_of_channels
+        self.ring = aligned_empty(
+            (RING_SLOTS, nchan*self.block_size), dtype).reshape(
+            RING_SLOTS, nchan, self.block_size)
+        # View of the last completely filled slot, handed to the plot while
+        # the driver already fills the next one
+        self.data_in = self.ring[-1]
+        # The driver and decimate both need every slot as one writable, 
+        # C-contiguous block of samples
+        assert all(slot.flags.c_contiguous and slot.flags.writeable 
+                   for slot in self.ring)
+
+        # Compile decimate for this sample type now instead of on the first
+        # plotted block
+        decimate(self.ring[0, 0, :2], 1, self.scaling[0], 
+                 np.empty(4, np.float32))
+
+        # Call the DAQmx binary read directly with arguments prepared here,
+        # instead of having a stream reader check the array and build the
+        # ctypes arguments again for every block. The function is cast to a
+        # prototype of our own so the argtypes nidaqmx sets stay untouched.
+        self.read_raw = ctypes.cast(read_func, FUNCTYPE(
+            ctypes.c_int32, lib_importer.task_handle, ctypes.c_int32, 
+            ctypes.c_double, ctypes.c_int32, ctypes.c_void_p, ctypes.c_uint32,
+            ctypes.POINTER(ctypes.c_int32), ctypes.c_void_p))
+        self.task_handle = self.task._handle
+        self.fill_mode = nico.FillMode.GROUP_BY_CHANNEL.value
+        self.slot_pointers = [slot.ctypes.data for slot in self.ring]
+        self.slot_size = nchan*self.block_size
+        self.samps_read = ctypes.c_int32()
+        self.samps_read_ref = ctypes.byref(self.samps_read)
+
+    def read_block(self):
+        """
+        Read one block from the DAQ buffer into the next ring slot. This runs
+        on the DAQmx callback thread, so it must not touch Tk.
+        """
+        slot = self.w_idx % RING_SLOTS
+        error_code = self.read_raw(
+            self.task_handle, self.block_size, 
+            nidaqmx.constants.WAIT_INFINITELY, self.fill_mode, 
+            self.slot_pointers[slot], self.slot_size, self.samps_read_ref, 
+            None)
+        if error_code != 0:
+            nidaqmx.errors.check_for_error(
+                error_code, samps_per_chan_read=self.samps_read.value)
+        self.data_in = self.ring[slot]
+        self.w_idx += 1
 
     def start_reading(self):
-        self.task.register_every_n_samples_acquired_into_buffer_event(
-            self.block_size, self.callback)
+        # Without a callback the driver only logs and no block is read
+        if self.callback is not None:
+            self.task.register_every_n_samples_acquired_into_buffer_event(
+                self.block_size, self.callback)
         self.task.start()
         
     def pausefunc(self):
@@ -96,20 +258,9 @@ class Mainwindow:
 
         self.createmenu()
 
-        # Find connected devices
-        system = nidaqmx.system.System.local()
+        # Filled by fill_channels once the connected devices are found
         self.channellist = []
-        try:
-            for device in system.devices:
-                for channel in device.ai_physical_chans:
-                    self.channellist.append(channel.name)
-        except:
-            tk.messagebox.showerror(
-                'DAQ error', 
-                'Error: Could not find a DAQ connected to your device.')
-
         self.phys_chans = tk.StringVar()
-        self.phys_chans.set(self.channellist[0])
 
         self.sample_rate = tk.StringVar()
         self.sample_rate.set("200k")
@@ -123,10 +274,22 @@ class Mainwindow:
         self.max_samples_file.set(3000000)
 
         self.reader = False
+        self.samples_in_file = 0
+        self.poll_id = None
+        self.priority_set = False
+        self.time_axis_key = None
+        # Scratch buffer the decimated blocks are written into for the plot
+        self.y_plot = np.empty((0, 0), np.float32)
 
         self.create_gui()
         self.plot_frame()
 
+        self.drain_id = self.mainwindow.after(DRAIN_INTERVAL, self.drain_plot)
+        self.counter_id = self.mainwindow.after(COUNTER_INTERVAL, 
+                                                self.flush_counter)
+        # Find connected devices without keeping the window from appearing
+        self.mainwindow.after(0, threading.Thread(target=self.enum_daq, 
+                                                  daemon=True).start)
         self.mainwindow.mainloop()
 
     def createmenu(self):
@@ -244,6 +407,12 @@ class Mainwindow:
         combo_termconfig.set(self.termconfigvar.get())
         combo_termconfig['state'] = 'readonly'
 
+        self.log_only = tk.BooleanVar()
+        self.log_only.set(False)
+        self.check_log_only = tk.Checkbutton(master=controlsframe, 
+                                             text="Log only", font=FONT, 
+                                             variable=self.log_only)
+
         self.btn_logging = tk.Button(master=controlsframe, text="Logging", 
                                      font=FONT, command=self.logging_toggle, 
                                      bg="red")
@@ -253,31 +422,73 @@ class Mainwindow:
                                   command=self.stop_reading)
 
         self.btn_logging.config(state="disabled")
+        self.btn_start.config(state="disabled")
         self.btn_stop.config(state="disabled")
 
-        lbl_tdms_folder.grid(row=0,column=0,sticky="e",padx=xpad,pady=ypad)
-        self.entry_tdms_folder.grid(row=0,column=1,columnspan=3,sticky="nsew",padx=xpad,pady=ypad)
-        btn_folder.grid(row=0,column=4,sticky="ew",padx=xpad,pady=ypad)
-        lbl_tdms_filename.grid(row=1,column=0,sticky="e",padx=xpad,pady=ypad)
-        lbl_tdms_filename_display.grid(row=1,column=1,columnspan=4,sticky="nsew",padx=xpad,pady=ypad)
-        lbl_amount_samples.grid(row=2,column=0,sticky="e",padx=xpad,pady=ypad)
-        lbl_amount_samples_display.grid(row=2,column=1,sticky="nsew",padx=xpad,pady=ypad)
-        lbl_max_samplesfile.grid(row=2,column=3,sticky="e",padx=xpad,pady=ypad)
-        entry_max_samplesfile.grid(row=2,column=4,sticky="nsew",padx=xpad,pady=ypad)
-        lbl_phys_chan.grid(row=3,column=0,sticky="e",padx=xpad,pady=ypad)
-        self.combo_phys_chan.grid(row=3,column=1,sticky="nsew",padx=xpad,pady=ypad)
-        lbl_range.grid(row=3,column=3,sticky="e",padx=xpad,pady=ypad)
-        combo_range.grid(row=3,column=4,sticky="nsew",padx=xpad,pady=ypad)
-        lbl_samps_per_chan.grid(row=4,column=0,sticky="e",padx=xpad,pady=ypad)
-        entry_samps_per_chan.grid(row=4,column=1,sticky="nsew",padx=xpad,pady=ypad)
-        lbl_sample_rate.grid(row=4,column=3,sticky="e",padx=xpad,pady=ypad)
-        entry_sample_rate.grid(row=4,column=4,sticky="nsew",padx=xpad,pady=ypad)
-        lbl_termconfig.grid(row=5,column=0,sticky="e",padx=xpad,pady=ypad)
-        combo_termconfig.grid(row=5,column=1,sticky="nsew",padx=xpad,pady=ypad)
-
-        self.btn_logging.grid(row=6,column=0,sticky="nsew",padx=xpad,pady=ypad)
-        self.btn_start.grid(row=6,column=1,sticky="nsew",padx=xpad,pady=ypad)
-        self.btn_stop.grid(row=6,column=3,sticky="nsew",columnspan=2,padx=xpad,pady=ypad)
+        # widget, row, column, sticky, columnspan
+        layout = ((lbl_tdms_folder,            0, 0, "e",    1),
+                  (self.entry_tdms_folder,     0, 1, "nsew", 3),
+                  (btn_folder,                 0, 4, "ew",   1),
+                  (lbl_tdms_filename,          1, 0, "e",    1),
+                  (lbl_tdms_filename_display,  1, 1, "nsew", 4),
+                  (lbl_amount_samples,         2, 0, "e",    1),
+                  (lbl_amount_samples_display, 2, 1, "nsew", 1),
+                  (lbl_max_samplesfile,        2, 3, "e",    1),
+                  (entry_max_samplesfile,      2, 4, "nsew", 1),
+                  (lbl_phys_chan,              3, 0, "e",    1),
+                  (self.combo_phys_chan,       3, 1, "nsew", 1),
+                  (lbl_range,                  3, 3, "e",    1),
+                  (combo_range,                3, 4, "nsew", 1),
+                  (lbl_samps_per_chan,         4, 0, "e",    1),
+                  (entry_samps_per_chan,       4, 1, "nsew", 1),
+                  (lbl_sample_rate,            4, 3, "e",    1),
+                  (entry_sample_rate,          4, 4, "nsew", 1),
+                  (lbl_termconfig,             5, 0, "e",    1),
+                  (combo_termconfig,           5, 1, "nsew", 1),
+                  (self.check_log_only,        5, 3, "w",    2),
+                  (self.btn_logging,           6, 0, "nsew", 1),
+                  (self.btn_start,             6, 1, "nsew", 1),
+                  (self.btn_stop,              6, 3, "nsew", 2))
+        for widget, row, column, sticky, columnspan in layout:
+            widget.grid(row=row, column=column, sticky=sticky, 
+                        columnspan=columnspan, padx=xpad, pady=ypad)
+
+    def enum_daq(self):
+        """
+        Find the analog input channels of all connected DAQs. This runs in a
+        background thread, the result is handed to fill_channels in the Tk
+        mainloop.
+        """
+        channellist = []
+        try:
+            self.prewarm_daqmx()
+            system = nidaqmx.system.System.local()
+            for device in system.devices:
+                for channel in device.ai_physical_chans:
+                    channellist.append(channel.name)
+        except:
+            channellist = []
+        self.mainwindow.after(0, self.fill_channels, channellist)
+
+    def prewarm_daqmx(self):
+        """
+        Load the DAQmx library and make a harmless call into it, so its 
+        one-time initialisation is not paid on the first block read.
+        """
+        error_buffer = ctypes.create_string_buffer(2048)
+        cfunc = lib_importer.windll.DAQmxGetExtendedErrorInfo
+        cfunc(error_buffer, 2048)
+
+    def fill_channels(self, channellist):
+        self.channellist = channellist
+        self.combo_phys_chan['values'] = self.channellist
+        if self.channellist:
+            self.phys_chans.set(self.channellist[0])
+            self.btn_start.config(state="normal")
+        else:
+            tk.messagebox.showerror(
+                'DAQ error', 
+                'Error: Could not find a DAQ connected to your device.')
 
     def plot_frame(self):
         dataframelabel = ttk.Label(text="Data written to TDMS", font=FONT, 
@@ -292,30 +503,75 @@ class Mainwindow:
         self.axs.set_xlabel('Time [s]')
         self.axs.set_ylabel('Amplitude [V]')
         self.axs.grid()
+        self.lines = [self.axs.plot([], [], animated=True)[0]]
+        # Axes limits last set by setup_lines
+        self.plot_limits = None
 
         self.canvas = tkagg.FigureCanvasTkAgg(self.fig, master=dataframe)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
         self.canvas.draw()
         self.canvas.get_tk_widget().pack()
 
         self.navtoolbar = tkagg.NavigationToolbar2Tk(self.canvas, dataframe)
 
+    def setup_lines(self, nchan, volt_range):
+        """
+        Prepare one persistent line per channel on fixed axes limits. The 
+        callback only swaps the y-data of these lines and blits them onto 
+        the background cached in on_draw.
+        """
+        if len(self.lines) != nchan:
+            for line in self.lines:
+                line.remove()
+            self.lines = [self.axs.plot([], [], animated=True)[0] 
+                          for _ in range(nchan)]
+        for line in self.lines:
+            line.set_data(self.x_plot, np.full(len(self.x_plot), np.nan))
+        # Keep the current view and the zoom history of the toolbar when the
+        # block time and voltage range are the same as on the previous Start.
+        # The lines are animated, so the cached background stays valid.
+        plot_limits = ((0, self.block_time), tuple(volt_range))
+        if plot_limits != self.plot_limits:
+            self.plot_limits = plot_limits
+            self.axs.set_xlim(*plot_limits[0])
+            self.axs.set_ylim(*plot_limits[1])
+            # on_draw caches the new background once Tk is idle, well before
+            # the first block arrives
+            self.canvas.draw_idle()
+            # New limits become the home view of the toolbar
+            self.navtoolbar.update()
+
+    def on_draw(self, event):
+        """
+        Cache the static part of the plot after every full redraw (start,
+        resize, zoom) so the lines can be blitted on top of it.
+        """
+        self._bg = self.canvas.copy_from_bbox(self.axs.bbox)
+        for line in self.lines:
+            self.axs.draw_artist(line)
+
     def openfolder(self):
         self.folder = tk.filedialog.askdirectory()
         self.entry_tdms_folder.insert(0,self.folder)
-        self.tdms_filename_var.set(self.folder
-                                   +'/TDMS_'
-                                   +datetime.now().strftime("%Y%m%d-%H%M%S")
-                                   +".tdms")
+        self.tdms_filename_var.set(new_tdms_name(self.folder))
         self.btn_logging.config(state="normal")
         self.logging_toggle()
 
     def start_reading(self):
+        # Parse the settings before touching the buttons, so invalid input
+        # leaves the controls as they were
+        try:
+            samp_rate = self.int_from_str(self.sample_rate.get())
+            samp_chan = self.int_from_str(self.sample_chan.get())
+            self.max_samples_int = self.max_samples_file.get()
+        except (ValueError, tk.TclError) as error:
+            tk.messagebox.showerror('Invalid setting', str(error))
+            return
+
         self.btn_start.config(state="disabled")
         self.btn_stop.config(state="normal")
         self.btn_logging.config(state="disabled")
-
-        samp_rate = self.int_from_str(self.sample_rate.get())
-        samp_chan = self.int_from_str(self.sample_chan.get())
+        self.check_log_only.config(state="disabled")
 
         if samp_chan/samp_rate < 0.1 or samp_chan/samp_rate > 5:
             tk.messagebox.showerror(
@@ -326,36 +582,73 @@ class Mainwindow:
             
             self.btn_start.config(state="normal")
             self.btn_stop.config(state="disabled")
+            self.check_log_only.config(state="normal")
 
             #if self.folder_chosen:
             #    self.btn_logging.config(state="normal")
 
-            self.amount_samples_var.set(0) 
+            self.set_samples_in_file(0)
 
         else:
             try:
+                # In log only mode the driver streams straight to TDMS and no
+                # samples are read into Python or plotted
+                log_only = self.logging and self.log_only.get()
                 self.reader = Reader(self.phys_chans.get(), samp_rate, samp_chan, 
                                      self.logging, self.rangedict[self.rangevar.get()], 
                                      self.termconfigdict[self.termconfigvar.get()], 
-									 self.callback)
+									 None if log_only else self.callback)
+                self.counted_idx = 0
+                self.priority_set = False
                 
-                self.x_axis = np.linspace(0, (samp_chan/samp_rate), samp_chan)
+                if not log_only:
+                    self.setup_time_axis(self.reader.block_size, samp_rate)
+                    y_shape = (self.reader.number_of_channels, 
+                               len(self.x_plot))
+                    if self.y_plot.shape != y_shape:
+                        self.y_plot = np.empty(y_shape, np.float32)
+                    self.setup_lines(self.reader.number_of_channels, 
+                                     self.rangedict[self.rangevar.get()])
 
                 self.reader.configure_task()
                 if self.logging:
-                    name = '/TDMS_'+datetime.now().strftime("%Y%m%d-%H%M%S")+".tdms"
+                    filename = new_tdms_name(self.folder)
                     self.reader.task.in_stream.configure_logging(
-                        self.folder+name, nidaqmx.constants.LoggingMode.LOG_AND_READ,
+                        filename, 
+                        nidaqmx.constants.LoggingMode.LOG if log_only 
+                        else nidaqmx.constants.LoggingMode.LOG_AND_READ,
                         group_name="group")
-                    self.tdms_filename_var.set(self.folder+name)
-                    self.reader.task.in_stream.input_buf_size = self.int_from_str(
-                        self.sample_rate.get()) * 5
+                    self.tdms_filename_var.set(filename)
 
                 self.reader.start_reading()
+                if log_only:
+                    self.counted_samples = 0
+                    self.poll_id = self.mainwindow.after(
+                        LOG_POLL_INTERVAL, self.poll_logged_samples)
 
             except nidaqmx.errors.DaqError as error:
                 self.show_error(error)
 
+    def setup_time_axis(self, samp_chan, samp_rate):
+        """
+        Build the time axis of a block and the x-data of the plot, in which
+        every decimated time appears twice, once for the minimum and once
+        for the maximum. Only rebuilt when block size or sample rate change.
+        """
+        if (samp_chan, samp_rate) == self.time_axis_key:
+            return
+        self.time_axis_key = (samp_chan, samp_rate)
+
+        # Times of every plot_stride-th sample, same spacing as a linspace
+        # over the whole block without building it
+        self.block_time = samp_chan/samp_rate
+        self.plot_stride = max(1, samp_chan // PLOT_POINTS)
+        x_plot = np.arange(samp_chan // self.plot_stride) * (
+            self.plot_stride * self.block_time / max(samp_chan - 1, 1))
+        self.x_plot = np.empty(2*len(x_plot), np.float32)
+        self.x_plot[0::2] = x_plot
+        self.x_plot[1::2] = x_plot
+
     def multichan_toggle(self):
         if self.multichan:
             self.multichan = False
@@ -376,47 +669,144 @@ class Mainwindow:
         self.btn_start.config(state="normal")
         self.btn_stop.config(state="disabled")
         self.btn_logging.config(state="normal")
+        self.check_log_only.config(state="normal")
 
-        self.amount_samples_var.set(0)        
+        if self.poll_id is not None:
+            self.mainwindow.after_cancel(self.poll_id)
+            self.poll_id = None
+        self.set_samples_in_file(0)
 
         self.reader.stopfunc()
 
     def callback(self, task_handle, every_n_samples_event_type, 
                  number_of_samples, callback_data):
-        self.reader.channel_reader.read_many_sample(
-            self.reader.data_in, 
-            number_of_samples_per_channel=self.reader.settings["sample block size"], 
-            timeout=nidaqmx.constants.WAIT_INFINITELY)
-        self.axs.cla()
-        self.axs.plot(self.x_axis, self.reader.data_in)
-        self.axs.set_xlabel('Time [s]')
-        self.axs.set_ylabel('Amplitude [V]')
-        self.axs.grid()
-        self.canvas.draw()
-        self.navtoolbar.update()
-        if self.logging:
-            self.amount_samples_var.set(self.amount_samples_var.get() 
-                                        + self.int_from_str(self.sample_rate.get()))
-        if self.amount_samples_var.get() >= self.max_samples_file.get():
-            name = '/TDMS_'+datetime.now().strftime("%Y%m%d-%H%M%S")+".tdms"
-            self.reader.task.in_stream.start_new_file(self.folder+name)
-            self.tdms_filename_var.set(self.folder+name)
-            self.amount_samples_var.set(0)
-            
+        if not self.priority_set:
+            self.raise_thread_priority()
+        self.reader.read_block()
         return 0
 
+    def raise_thread_priority(self):
+        """
+        Run the calling thread, the DAQmx callback thread, above normal
+        priority on Windows so a busy GUI can not delay the reads.
+        """
+        self.priority_set = True
+        if os.name == "nt":
+            # Own library instance, so the prototypes set here do not change
+            # ctypes.windll.kernel32 for anyone else
+            kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+            kernel32.GetCurrentThread.restype = wintypes.HANDLE
+            kernel32.GetCurrentThread.argtypes = ()
+            kernel32.SetThreadPriority.restype = wintypes.BOOL
+            kernel32.SetThreadPriority.argtypes = (wintypes.HANDLE, ctypes.c_int)
+            if not kernel32.SetThreadPriority(kernel32.GetCurrentThread(), 
+                                              THREAD_PRIORITY_ABOVE_NORMAL):
+                print("Could not raise the DAQ thread priority:", 
+                      ctypes.WinError(ctypes.get_last_error()))
+
+    def drain_plot(self):
+        """
+        Plot the newest block the DAQ callback has read. Blocks that arrive
+        faster than the GUI can plot are skipped in the plot, not in the 
+        TDMS file.
+        """
+        # Schedule the next run first, so an error in one frame only drops
+        # that frame
+        self.drain_id = self.mainwindow.after(DRAIN_INTERVAL, self.drain_plot)
+
+        reader = self.reader
+        w_idx = reader.w_idx if reader else 0
+        if reader and reader.task and w_idx != reader.r_idx:
+            reader.r_idx = w_idx
+
+            for line, row, coeffs, y_plot in zip(self.lines, reader.data_in,
+                                                 reader.scaling, self.y_plot):
+                decimate(row, self.plot_stride, coeffs, y_plot)
+                line.set_ydata(y_plot)
+            self.canvas.restore_region(self._bg)
+            for line in self.lines:
+                self.axs.draw_artist(line)
+            self.canvas.blit(self.axs.bbox)
+
+    def flush_counter(self):
+        """
+        Add the samples of all blocks read since the previous call to the
+        file counter in one go and start a new TDMS file when it is full.
+        """
+        # Schedule the next run first, so an error while starting a new file
+        # does not stop counting for the rest of the session
+        self.counter_id = self.mainwindow.after(COUNTER_INTERVAL, 
+                                                self.flush_counter)
+
+        reader = self.reader
+        w_idx = reader.w_idx if reader else 0
+        if reader and reader.task and w_idx != self.counted_idx:
+            new_blocks = w_idx - self.counted_idx
+            self.counted_idx = w_idx
+
+            # Logging as it was at Start, choosing a folder while running
+            # toggles self.logging but not the task
+            if reader.logging:
+                try:
+                    self.add_samples(new_blocks * reader.block_size)
+                except nidaqmx.errors.DaqError as error:
+                    self.show_error(error)
+
+    def poll_logged_samples(self):
+        """
+        Count the samples the driver acquired since the previous call. Used
+        in log only mode, where no DAQ callback reads blocks.
+        """
+        self.poll_id = None
+        try:
+            acquired = self.reader.task.in_stream.total_samp_per_chan_acquired
+            self.add_samples(acquired - self.counted_samples)
+        except nidaqmx.errors.DaqError as error:
+            # Only place a driver error shows up in log only mode, stops the
+            # task and leaves the poll unscheduled
+            self.show_error(error)
+            return
+        self.counted_samples = acquired
+        self.poll_id = self.mainwindow.after(LOG_POLL_INTERVAL, 
+                                             self.poll_logged_samples)
+
+    def add_samples(self, samples):
+        """
+        Add samples to the count of the current TDMS file and continue in a
+        new file once it is full.
+        """
+        samples_in_file = self.samples_in_file + samples
+        if samples_in_file >= self.max_samples_int:
+            filename = new_tdms_name(self.folder)
+            self.reader.task.in_stream.start_new_file(filename)
+            self.tdms_filename_var.set(filename)
+            samples_in_file = 0
+        self.set_samples_in_file(samples_in_file)
+
+    def set_samples_in_file(self, samples):
+        """
+        Keep the count of samples in the current file as a plain int and 
+        only write it to the Tk variable when it changed.
+        """
+        if samples != self.samples_in_file:
+            self.samples_in_file = samples
+            self.amount_samples_var.set(samples)
+
     def int_from_str(self, var_string):
-        var_string = var_string.replace("k", "E3")
-        var_string = var_string.replace("M", "E6")
-        while var_string[-1] not in "1234567890":
-            var_string = var_string[:-1]
-        return int(float(var_string))
+        match = NUMBER_RE.search(var_string)
+        if match is None:
+            raise ValueError("No number in {!r}".format(var_string))
+        return int(float(match.group(1)) * SI_PREFIXES[match.group(2)])
 
     def defaultsettings(self):
         print("werkt nog niet")
 
     def quit_me(self):
         print('Closing the program')
+        self.mainwindow.after_cancel(self.drain_id)
+        self.mainwindow.after_cancel(self.counter_id)
+        if self.poll_id is not None:
+            self.mainwindow.after_cancel(self.poll_id)
         self.mainwindow.quit()
         self.mainwindow.destroy()
         if self.reader != False:
@@ -425,7 +815,6 @@ class Mainwindow:
                 print("Stopped Reader")
 
     def show_error(self, error):
-        from nidaqmx._lib import lib_importer
         error_buffer = ctypes.create_string_buffer(2048)
         cfunc = lib_importer.windll.DAQmxGetExtendedErrorInfo
         cfunc(error_buffer, 2048)